@@ -22,5 +22,4 @@ CREATE TABLE blocks (
     "lastUpdated" timestamp default current_timestamp
 );
 
-CREATE INDEX blocks_number_idx ON blocks ("number");
 CREATE INDEX idx_blocks_timestamp ON blocks ("timestamp");
\ No newline at end of file
@@ -0,0 +1,6 @@
+-- Covering index for the block range and latest blocks queries of the dashboards
+-- (visualization/), so they can be served with an index-only scan
+CREATE INDEX IF NOT EXISTS blocks_number_cover_idx ON blocks ("number") INCLUDE ("timestamp", "transactionsCount", "gasUsed", "size");
+
+-- The covering index makes the plain index on "number" from blocks.sql redundant
+DROP INDEX IF EXISTS blocks_number_idx;
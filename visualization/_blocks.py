@@ -0,0 +1,160 @@
+# _blocks.py
+# Shared database access and plotting helpers of the dashboards
+# uses .env file in the parent directory to access environment variables
+# expects the blocks_number_cover_idx index from model/indexes.sql
+import psycopg2
+import psycopg2.pool
+import numpy as np
+from matplotlib.figure import Figure
+from dotenv import load_dotenv
+import os
+import io
+
+# Define the columns fetched for each block
+BLOCK_COLUMNS = "number, \"timestamp\", COALESCE(\"transactionsCount\", 0), COALESCE(\"gasUsed\", 0)::float8, size"
+
+# Define the columns of the blocks array, using the narrowest type that holds
+# each value (the gas used only needs to be plotted, not summed exactly)
+BLOCKS_DTYPE = np.dtype([
+    ("number", np.int32),
+    ("timestamp", np.int64),
+    ("transactionsCount", np.int32),
+    ("gasUsed", np.float32),
+    ("size", np.int32),
+    ("blocktime", np.int32),
+    ("tps", np.float32),
+])
+
+# Define the query for the blocks between two blocks, exported with a binary COPY.
+# The blocktime and TPS of each block are computed with window functions from the
+# next block, the last block keeps the values of the previous block (GREATEST ignores
+# NULL, so the divisions are guarded to stay NULL when there is no next or previous block)
+RANGE_QUERY = f"""
+COPY (
+    SELECT
+        {BLOCK_COLUMNS},
+        COALESCE(LEAD("timestamp") OVER w - "timestamp", "timestamp" - LAG("timestamp") OVER w, 0)::int4,
+        COALESCE(
+            CASE WHEN LEAD("timestamp") OVER w IS NOT NULL
+                THEN COALESCE("transactionsCount", 0)::float8 / GREATEST(LEAD("timestamp") OVER w - "timestamp", 1)
+            END,
+            CASE WHEN LAG("timestamp") OVER w IS NOT NULL
+                THEN COALESCE(LAG("transactionsCount") OVER w, 0)::float8 / GREATEST("timestamp" - LAG("timestamp") OVER w, 1)
+            END,
+            0
+        )::float8
+    FROM blocks
+    WHERE number BETWEEN %s AND %s
+    WINDOW w AS (ORDER BY number)
+    ORDER BY number ASC
+) TO STDOUT (FORMAT BINARY)
+"""
+
+# Define the layout of a row of the binary COPY of RANGE_QUERY: the number of fields,
+# then the length and the big-endian value of each field. None of the columns can
+# be NULL, so every row has the same size
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+COPY_ROW_DTYPE = np.dtype([
+    ("fields", ">i2"),
+    ("number_length", ">i4"), ("number", ">i8"),
+    ("timestamp_length", ">i4"), ("timestamp", ">i4"),
+    ("transactionsCount_length", ">i4"), ("transactionsCount", ">i4"),
+    ("gasUsed_length", ">i4"), ("gasUsed", ">f8"),
+    ("size_length", ">i4"), ("size", ">i4"),
+    ("blocktime_length", ">i4"), ("blocktime", ">i4"),
+    ("tps_length", ">i4"), ("tps", ">f8"),
+])
+
+# Define the labels of the subplots, in the order of the axes of create_figure
+PLOT_LABELS = (
+    "Timestamp",
+    "Transaction Count",
+    "Gas Used",
+    "TPS (transaction/sec)",
+    "Blocktime (sec)",
+    "Block Size (KB)",
+)
+
+# Load environment variables from the .env file in the parent directory
+def load_env():
+    dotenv_path = os.path.join(os.path.dirname(__file__), "..", ".env")
+    load_dotenv(dotenv_path)
+
+# Create a pool of connections to the local PostgreSQL database
+def create_pool(minconn=1, maxconn=4):
+    return psycopg2.pool.ThreadedConnectionPool(
+        minconn,
+        maxconn,
+        host=os.getenv("POSTGRES_HOST"),
+        port=os.getenv("POSTGRES_PORT"),
+        user=os.getenv("POSTGRES_USER"),
+        password=os.getenv("POSTGRES_PASSWORD"),
+        database=os.getenv("POSTGRES_DATABASE")
+    )
+
+# Define the function to get the number of the latest block
+def fetch_latest_number(pool):
+    conn = pool.getconn()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT number FROM blocks ORDER BY number DESC LIMIT 1")
+        row = cur.fetchone()
+        cur.close()
+    finally:
+        pool.putconn(conn)
+    return row[0]
+
+# Define the function to get the blocks between two blocks as a BLOCKS_DTYPE array,
+# decoding the binary COPY of the rows with numpy instead of one Python object per value
+def fetch_range(pool, lo, hi):
+    conn = pool.getconn()
+    try:
+        cur = conn.cursor()
+        buf = io.BytesIO()
+        cur.copy_expert(cur.mogrify(RANGE_QUERY, (lo, hi)).decode(), buf)
+        cur.close()
+    finally:
+        pool.putconn(conn)
+    data = buf.getbuffer()
+    if bytes(data[:len(COPY_SIGNATURE)]) != COPY_SIGNATURE:
+        raise ValueError("Unexpected binary COPY signature")
+    # Skip the signature, the flags and the header extension, and drop the trailer
+    extension_length = int.from_bytes(data[len(COPY_SIGNATURE) + 4:len(COPY_SIGNATURE) + 8], "big")
+    body = data[len(COPY_SIGNATURE) + 8 + extension_length:-2]
+    if len(body) % COPY_ROW_DTYPE.itemsize:
+        raise ValueError(f"Binary COPY body of {len(body)} bytes is not made of {COPY_ROW_DTYPE.itemsize} byte rows")
+    rows = np.frombuffer(body, dtype=COPY_ROW_DTYPE)
+    # Check the layout of every row, a changed query or column type would otherwise
+    # be decoded silently into wrong values
+    if np.any(rows["fields"] != len(BLOCKS_DTYPE.names)):
+        raise ValueError(f"Binary COPY rows don't have {len(BLOCKS_DTYPE.names)} fields")
+    for name in BLOCKS_DTYPE.names:
+        if np.any(rows[f"{name}_length"] != COPY_ROW_DTYPE[name].itemsize):
+            raise ValueError(f"Binary COPY column {name} isn't {COPY_ROW_DTYPE[name].itemsize} bytes wide")
+    blocks = np.empty(len(rows), dtype=BLOCKS_DTYPE)
+    for name in BLOCKS_DTYPE.names:
+        blocks[name] = rows[name]
+    return blocks
+
+# Define the function to calculate the TPS and the blocktime of each block except
+# the last one from its next block, the last block keeps the values of the previous block
+def derive_tps_bt(timestamps, tx_counts):
+    blocktimes = np.diff(timestamps)
+    tps = tx_counts[:-1] / np.maximum(blocktimes, 1)
+    return np.append(tps, tps[-1]), np.append(blocktimes, blocktimes[-1])
+
+# Create the figure with six subplots for the timestamp, transaction count, gas used,
+# TPS, blocktime and block size, in the order of PLOT_LABELS. A headless figure is
+# not managed by pyplot, which is faster when it is only saved to a file
+def create_figure(headless=False):
+    if headless:
+        fig = Figure(figsize=(15, 10))
+        ax_grid = fig.subplots(nrows=3, ncols=2)
+    else:
+        import matplotlib.pyplot as plt
+        fig, ax_grid = plt.subplots(nrows=3, ncols=2, figsize=(15, 10))
+    axes = tuple(ax_grid.flat)
+    for ax, label in zip(axes, PLOT_LABELS):
+        ax.set_xlabel("Block Number")
+        ax.set_ylabel(label)
+    return fig, axes
@@ -1,12 +1,14 @@
 # liveDashboard.py
 # Display a live dashboard of the blockchain
 # uses .env file in the parent directory to access environment variables
+# expects the blocks_number_cover_idx index from model/indexes.sql
 import psycopg2
+import psycopg2.pool
+import numpy as np
 import matplotlib.pyplot as plt
-from dotenv import load_dotenv
-import os
+import weakref
 from matplotlib.animation import FuncAnimation
-from datetime import datetime
+from _blocks import load_env, create_pool, derive_tps_bt, create_figure, BLOCK_COLUMNS, PLOT_LABELS
 
 PLOT_TIME_WINDOW_MINUTES = 5
 AVERAGE_BLOCK_TIME_SECONDS = 6
@@ -14,231 +16,138 @@ NUMBER_OF_BLOCKS = int(PLOT_TIME_WINDOW_MINUTES * 60 / AVERAGE_BLOCK_TIME_SECOND
 # NUMBER_OF_BLOCKS = 100
 UPDATE_INTERVAL = 6000
 
-# Load environment variables from the .env file in the parent directory
-dotenv_path = os.path.join(os.path.dirname(__file__), "..", ".env")
-load_dotenv(dotenv_path)
-
-# Access environment variables
-postgres_host = os.getenv("POSTGRES_HOST")
-postgres_port = os.getenv("POSTGRES_PORT")
-postgres_user = os.getenv("POSTGRES_USER")
-postgres_password = os.getenv("POSTGRES_PASSWORD")
-postgres_database = os.getenv("POSTGRES_DATABASE")
-
-# Connect to the local PostgreSQL database
-conn = psycopg2.connect(
-    host=postgres_host,
-    port=postgres_port,
-    user=postgres_user,
-    password=postgres_password,
-    database=postgres_database
-)
+load_env()
+pool = create_pool()
 
-# Set the page size and the FIFO size
-page_size = NUMBER_OF_BLOCKS
+# Set the FIFO size
 fifo_size = NUMBER_OF_BLOCKS
 
-# Initialize empty lists for the X and Y data points
-x_values_tx, y_values_tx = [], []
-x_values_gas, y_values_gas = [], []
-x_values_ts, y_values_ts = [], []
-x_values_tps, y_values_tps = [], []
-x_values_bt, y_values_bt = [], []
-x_values_size, y_values_size = [], []
+# Set the number of blocks before the last block fetched that are read again on each
+# tick, the indexer inserts blocks concurrently so they can be committed out of order
+FETCH_OVERLAP = 10
 
-plt.rcParams['figure.raise_window'] = False
+# Define the prepared statement for the latest blocks after a block, bounded to the
+# FIFO size, so the server parses and plans it once per connection instead of on
+# every tick
+PREPARE_QUERIES = (
+    f"PREPARE latest_blocks(bigint, bigint) AS SELECT * FROM (SELECT {BLOCK_COLUMNS} FROM blocks WHERE number > $1 ORDER BY number DESC LIMIT $2) latest ORDER BY number ASC",
+)
+LATEST_BLOCKS_QUERY = "EXECUTE latest_blocks(%s, %s)"
 
-# Create the figure with five subplots for the timestamp, transaction count, gas used, TPS, and blocktime
-fig, ((ax_ts, ax_tx), (ax_gas, ax_tps), (ax_bt, ax_size)) = plt.subplots(nrows=3, ncols=2, figsize=(15, 10))
-
-ax_ts.set_xlabel("Block Number")
-ax_ts.set_ylabel("Timestamp")
-ax_tx.set_xlabel("Block Number")
-ax_tx.set_ylabel("Transaction Count")
-ax_gas.set_xlabel("Block Number")
-ax_gas.set_ylabel("Gas Used")
-ax_tps.set_xlabel("Block Number")
-ax_tps.set_ylabel("TPS (transaction/sec)")
-ax_bt.set_xlabel("Block Number")
-ax_bt.set_ylabel("Blocktime (sec)")
-ax_size.set_xlabel("Block Number")
-ax_size.set_ylabel("Block Size (KB)")
-
-# Define the update function for the timestamp subplot
-def update_plot_ts(frame):
-    global x_values_ts, y_values_ts
-    cur = conn.cursor()
-    cur.execute(f"SELECT number, \"timestamp\" FROM blocks ORDER BY number DESC LIMIT {fifo_size}")
-    rows = cur.fetchall()[::-1]
-    cur.close()
-    # Append each row to the X and Y data points
-    for row in rows:
-        x_values_ts.append(row[0])
-        y_values_ts.append(row[1])
-    # Remove the oldest data points if the FIFO size is exceeded
-    if len(x_values_ts) > fifo_size:
-        x_values_ts = x_values_ts[-fifo_size:]
-        y_values_ts = y_values_ts[-fifo_size:]
-    ax_ts.clear()
-    ax_ts.plot(x_values_ts, y_values_ts, linewidth=0.5, label="Timestamp")
-    ax_ts.legend()
-    plt.pause(0.01)
-
-# Define the update function for the transaction count subplot
-def update_plot_tx(frame):
-    global x_values_tx, y_values_tx
-    cur = conn.cursor()
-    cur.execute(f"SELECT number, \"transactionsCount\" FROM blocks ORDER BY number DESC LIMIT {fifo_size}")
-    rows = cur.fetchall()[::-1]
-    cur.close()
-    # Append each row to the X and Y data points
-    for row in rows:
-        x_values_tx.append(row[0])
-        y_values_tx.append(row[1])
-    # Remove the oldest data points if the FIFO size is exceeded
-    if len(x_values_tx) > fifo_size:
-        x_values_tx = x_values_tx[-fifo_size:]
-        y_values_tx = y_values_tx[-fifo_size:]
-    ax_tx.clear()
-    ax_tx.plot(x_values_tx, y_values_tx, linewidth=0.5, label="Transaction Count")
-    ax_tx.legend()
-    plt.pause(0.01)
-
-# Define the update function for the gas used subplot
-def update_plot_gas(frame):
-    global x_values_gas, y_values_gas
-    cur = conn.cursor()
-    cur.execute(f"SELECT number, \"gasUsed\" FROM blocks ORDER BY number DESC LIMIT {fifo_size}")
-    rows = cur.fetchall()[::-1]
-    cur.close()
-    # Append each row to the X and Y data points
-    for row in rows:
-        x_values_gas.append(row[0])
-        y_values_gas.append(row[1])
-    # Remove the oldest data points if the FIFO size is exceeded
-    if len(x_values_gas) > fifo_size:
-        x_values_gas = x_values_gas[-fifo_size:]
-        y_values_gas = y_values_gas[-fifo_size:]
-    ax_gas.clear()
-    ax_gas.plot(x_values_gas, y_values_gas, linewidth=0.5, label="Gas Used")
-    ax_gas.legend()
-    plt.pause(0.01)
-
-# Define the update function for the TPS subplot
-def update_plot_tps(frame):
-    global x_values_tps, y_values_tps
-    cur = conn.cursor()
-    cur.execute(f"SELECT number, \"transactionsCount\", \"timestamp\" FROM blocks ORDER BY number DESC LIMIT {fifo_size}")
-    rows = cur.fetchall()[::-1]
-    cur.close()
-    # Calculate TPS for each block except the last one and append to the X and Y data points
-    tx_count_diff = 0
-    for i in range(len(rows)-1):
-        # tx_count_diff = rows[i+1][1] - rows[i][1]
-        # if tx_count_diff > 0:
-        #     time_diff = (datetime.fromtimestamp(rows[i+1][2]) - datetime.fromtimestamp(rows[i][2])).total_seconds()
-        #     tps = tx_count_diff / time_diff if time_diff > 0 else 0
-        # else:
-        #     tps = 0
-        time_diff = time_diff = (datetime.fromtimestamp(rows[i+1][2]) - datetime.fromtimestamp(rows[i][2])).total_seconds()
-        tps = rows[i][1] / time_diff #if time_diff > 0 else 0
-
-
-        x_values_tps.append(rows[i][0])
-        y_values_tps.append(tps)
-    # Add the last block separately with a TPS of 0
-    x_values_tps.append(rows[-1][0])
-    y_values_tps.append(y_values_tps[-1])
-    # Remove the oldest data points if the FIFO size is exceeded
-    if len(x_values_tps) > fifo_size:
-        x_values_tps = x_values_tps[-fifo_size:]
-        y_values_tps = y_values_tps[-fifo_size:]
-    ax_tps.clear()
-    ax_tps.plot(x_values_tps, y_values_tps, linewidth=0.5, label="TPS (transaction/sec)")
-    ax_tps.legend()
-    plt.pause(0.01)
-
-# Define the update function for the blocktime subplot
-def update_plot_bt(frame):
-    global x_values_bt, y_values_bt
-    cur = conn.cursor()
-    cur.execute(f"SELECT number, \"timestamp\" FROM blocks ORDER BY number DESC LIMIT {fifo_size}")
-    rows = cur.fetchall()[::-1]
-    cur.close()
-    # Calculate the blocktime difference for each block except the last one and append to the Y data points
-    y_values_bt = []
-    for i in range(len(rows)-1):
-        time_diff = (datetime.fromtimestamp(rows[i+1][1]) - datetime.fromtimestamp(rows[i][1])).total_seconds()
-        y_values_bt.append(time_diff)
-        x_values_bt.append(rows[i][0])
-    # Add the last block separately with a blocktime of same as the previous block
-    x_values_bt.append(rows[-1][0])
-    y_values_bt.append(y_values_bt[-1])
-    # Remove the oldest data points if the FIFO size is exceeded
-    if len(x_values_bt) > fifo_size:
-        x_values_bt = x_values_bt[-fifo_size:]
-        y_values_bt = y_values_bt[-fifo_size:]
-    ax_bt.clear()
-    ax_bt.plot(x_values_bt, y_values_bt, linewidth=0.5, label="Blocktime (sec)")
-    ax_bt.legend()
-    plt.pause(0.01)
-
-def update_plot_size(frame):
-    global x_values_size, y_values_size
-    cur = conn.cursor()
-    cur.execute(f"SELECT number, size FROM blocks ORDER BY number DESC LIMIT {fifo_size}")
-    rows = cur.fetchall()[::-1]
-    cur.close()
-    # Append each row to the X and Y data points
-    for row in rows:
-        size_kb = row[1] / 1024
-        x_values_size.append(row[0])
-        y_values_size.append(size_kb)
-    # Remove the oldest data points if the FIFO size is exceeded
-    if len(x_values_size) > fifo_size:
-        x_values_size = x_values_size[-fifo_size:]
-        y_values_size = y_values_size[-fifo_size:]
-    ax_size.clear()
-    ax_size.plot(x_values_size, y_values_size, linewidth=0.5, label="Block Size (KB)")
-    ax_size.legend()
-    plt.pause(0.01)
+# Keep track of the pooled connections the statements were prepared on
+prepared_conns = weakref.WeakSet()
 
+# Initialize the FIFO as a ring buffer with one column per block metric, where each
+# block is stored at the row of its number modulo the FIFO size, and the number of
+# the last block fetched
+COL_NUMBER, COL_TIMESTAMP, COL_TX_COUNT, COL_GAS_USED, COL_SIZE_KB = range(5)
+fifo = np.full((fifo_size, 5), np.nan, dtype=np.float64)
+last_block = -1
+
+plt.rcParams['figure.raise_window'] = False
+
+fig, axes = create_figure()
+
+# Create one persistent line per subplot with its legend, the update function only replaces their data
+lines = tuple(ax.plot([], [], linewidth=0.5, label=label)[0] for ax, label in zip(axes, PLOT_LABELS))
+for ax in axes:
+    ax.legend()
+
+# Define the function to fetch blocks, returns None if the query failed
+def fetch_blocks(query, params):
+    conn = None
+    failed = False
+    try:
+        # Getting a connection reconnects if the pool has no idle one, which can
+        # fail while the database is down
+        conn = pool.getconn()
+        # Read-only queries, don't keep a transaction open between ticks
+        conn.autocommit = True
+        cur = conn.cursor()
+        if conn not in prepared_conns:
+            for prepare_query in PREPARE_QUERIES:
+                cur.execute(prepare_query)
+            prepared_conns.add(conn)
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+    except (psycopg2.Error, psycopg2.pool.PoolError) as e:
+        # Skip the tick and retry on the next one. The connection is closed whatever the
+        # error, it may be broken or still hold the prepared statements, so the pool
+        # reconnects and the statements are prepared again on a fresh connection
+        print(f"Error fetching blocks: {e}")
+        failed = True
+        return None
+    finally:
+        if conn is not None:
+            pool.putconn(conn, close=failed)
+
+# Define the function to rescale a subplot when its data leaves the view, returns
+# True if the view changed. The new view ends a tenth of fifo_size blocks after the
+# newest block and leaves a tenth of the value range above and below, so it is kept
+# for several ticks while the newest data stays near the right edge
+def rescale(ax, x_values, y_values):
+    (x_min, x_max), (y_min, y_max) = ax.get_xlim(), ax.get_ylim()
+    low, high = np.min(y_values), np.max(y_values)
+    if x_min <= x_values[0] and x_values[-1] <= x_max and y_min <= low and high <= y_max:
+        return False
+    margin = (high - low) / 10 or 1
+    ax.set_xlim(x_values[-1] - fifo_size, x_values[-1] + max(fifo_size // 10, 1))
+    ax.set_ylim(low - margin, high + margin)
+    return True
+
+# Define the update function for all subplots, fetching only the new blocks on each tick
+def update_all(frame):
+    global last_block
+    # Fetch the new blocks and read the last ones again in case a block was committed late
+    rows = fetch_blocks(LATEST_BLOCKS_QUERY, (last_block - FETCH_OVERLAP, fifo_size))
+    if not rows:
+        return lines
+    last_block = max(last_block, rows[-1][0])
+    # Write the blocks of the FIFO window in place at the row of their number,
+    # overwriting the blocks that left the window and the blocks read again
+    new_blocks = np.asarray(rows, dtype=np.float64)
+    new_blocks[:, COL_SIZE_KB] /= 1024
+    new_blocks = new_blocks[new_blocks[:, COL_NUMBER] > last_block - fifo_size]
+    slots = new_blocks[:, COL_NUMBER].astype(np.int64) % fifo_size
+    # Nothing to redraw if no block was added or changed
+    if np.array_equal(fifo[slots], new_blocks):
+        return lines
+    fifo[slots] = new_blocks
+    # Take the blocks of the window from the oldest to the newest, skipping the
+    # missing ones
+    window = np.arange(last_block - fifo_size + 1, last_block + 1)
+    blocks = fifo[window % fifo_size]
+    blocks = blocks[blocks[:, COL_NUMBER] == window]
+    if len(blocks) < 2:
+        return lines
+    numbers = blocks[:, COL_NUMBER]
+    tps, blocktimes = derive_tps_bt(blocks[:, COL_TIMESTAMP], blocks[:, COL_TX_COUNT])
+    y_values = (
+        blocks[:, COL_TIMESTAMP],
+        blocks[:, COL_TX_COUNT],
+        blocks[:, COL_GAS_USED],
+        tps,
+        blocktimes,
+        blocks[:, COL_SIZE_KB],
+    )
+    for line, values in zip(lines, y_values):
+        line.set_data(numbers, values)
+    # Blitting only redraws the lines, so the figure is redrawn to refresh the ticks
+    # and the cached background only when the data leaves the view of a subplot
+    views_changed = False
+    for line, values in zip(lines, y_values):
+        views_changed |= rescale(line.axes, numbers, values)
+    if views_changed:
+        fig.canvas.draw()
+    return lines
 
 # Create the initial plot for the timestamp, transaction count, gas used, TPS, and blocktime subplots
-cur = conn.cursor()
-cur.execute(f"SELECT number, \"timestamp\", \"transactionsCount\", \"gasUsed\", \"size\" FROM blocks ORDER BY number DESC LIMIT {page_size}")
-rows = cur.fetchall()[::-1]
-cur.close()
-# Append each row to the X and Y data points for all five subplots
-for row in rows:
-    x_values_ts.append(row[0])
-    y_values_ts.append(row[1])
-    x_values_tx.append(row[0])
-    y_values_tx.append(row[2])
-    x_values_gas.append(row[0])
-    y_values_gas.append(row[3])
-    x_values_size.append(row[0])
-    y_values_size.append(row[4])
-ax_ts.plot(x_values_ts, y_values_ts, linewidth=0.5, label="Timestamp")
-ax_tx.plot(x_values_tx, y_values_tx, linewidth=0.5, label="Transaction Count")
-ax_gas.plot(x_values_gas, y_values_gas, linewidth=0.5, label="Gas Used")
-ax_tps.plot(x_values_tps, y_values_tps, linewidth=0.5, label="TPS (transaction/sec)")
-ax_bt.plot(x_values_bt, y_values_bt, linewidth=0.5, label="Blocktime (sec)")
-ax_size.plot(x_values_size, y_values_size, linewidth=0.5, label="Block size (KB)")
-ax_ts.legend()
-ax_tx.legend()
-ax_gas.legend()
-ax_tps.legend()
-ax_bt.legend()
-ax_size.legend()
-
-# Animate the subplots by updating them every few seconds
-ani_ts = FuncAnimation(fig, update_plot_ts, interval=UPDATE_INTERVAL, blit=True, repeat=False)
-ani_tx = FuncAnimation(fig, update_plot_tx, interval=UPDATE_INTERVAL, blit=True, repeat=False)
-ani_gas = FuncAnimation(fig, update_plot_gas, interval=UPDATE_INTERVAL, blit=True, repeat=False)
-ani_tps = FuncAnimation(fig, update_plot_tps, interval=UPDATE_INTERVAL, blit=True, repeat=False)
-ani_bt = FuncAnimation(fig, update_plot_bt, interval=UPDATE_INTERVAL, blit=True, repeat=False)
-ani_size = FuncAnimation(fig, update_plot_size, interval=UPDATE_INTERVAL, blit=True, repeat=False)
+update_all(0)
+
+# Animate all subplots with a single animation updating them every few seconds
+ani = FuncAnimation(fig, update_all, interval=UPDATE_INTERVAL, blit=True, cache_frame_data=False, repeat=False)
 
 # Show the plot
 try: